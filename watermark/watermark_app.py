@@ -1,18 +1,46 @@
 import os
+import io
 import sys
 import argparse
 import gc
-import uuid
-import time
+import hashlib
+import functools
+from collections import OrderedDict
+import queue
 import threading
-import psutil  # 用於監控記憶體使用量
-from PIL import Image
-import concurrent.futures
-import configparser
+from PIL import Image, UnidentifiedImageError
+
+# 選用依賴：cykooz.resizer 以 SIMD (AVX2/SSE4.1/NEON) 實作 Lanczos 縮放，未安裝時退回 Pillow；
+# 3.x 版的模組為 cykooz.resizer，4.x 版改名為 cykooz_resizer，兩者 API 相同
+try:
+    from cykooz.resizer import FilterType, ResizeAlg, ResizeOptions, Resizer
+    RESIZE_BACKEND = 'cykooz.resizer'
+except ImportError:
+    try:
+        from cykooz_resizer import FilterType, ResizeAlg, ResizeOptions, Resizer
+        RESIZE_BACKEND = 'cykooz_resizer'
+    except ImportError:
+        Resizer = None
+        RESIZE_BACKEND = 'Pillow'
+
+# Pillow 9.1 起濾波器常數移至 Image.Resampling，舊版直接定義於 Image；於載入時決定一次即可
+_RESAMPLING = getattr(Image, "Resampling", Image)
+
+# 縮放演算法：名稱對應 (Pillow 濾波器, cykooz.resizer 濾波器名稱)；Pillow 的 BICUBIC 即 Catmull-Rom，
+# nearest 不需卷積濾波器，以 None 表示
+RESAMPLE_METHODS = {
+    "lanczos": (_RESAMPLING.LANCZOS, "lanczos3"),
+    "bicubic": (_RESAMPLING.BICUBIC, "catmull_rom"),
+    "bilinear": (_RESAMPLING.BILINEAR, "bilinear"),
+    "nearest": (_RESAMPLING.NEAREST, None),
+}
+_RESAMPLE = _RESAMPLING.LANCZOS
 
 # -----------------------------
 # 自訂型別函式 (參數驗證)
 # -----------------------------
+# 數值驗證函式為純函式，相同字串重複驗證時直接取用快取結果（驗證失敗拋出的例外不會被快取）
+@functools.lru_cache(maxsize=256)
 def positive_int(value):
     try:
         ivalue = int(value)
@@ -22,6 +50,7 @@ def positive_int(value):
         raise argparse.ArgumentTypeError(f"{value} 必須大於 0")
     return ivalue
 
+@functools.lru_cache(maxsize=256)
 def non_negative_int(value):
     try:
         ivalue = int(value)
@@ -31,6 +60,7 @@ def non_negative_int(value):
         raise argparse.ArgumentTypeError(f"{value} 不能小於 0")
     return ivalue
 
+@functools.lru_cache(maxsize=256)
 def positive_float(value):
     try:
         fvalue = float(value)
@@ -40,6 +70,7 @@ def positive_float(value):
         raise argparse.ArgumentTypeError(f"{value} 必須大於 0")
     return fvalue
 
+@functools.lru_cache(maxsize=256)
 def opacity_type(value):
     try:
         fvalue = float(value)
@@ -49,6 +80,7 @@ def opacity_type(value):
         raise argparse.ArgumentTypeError("透明度必須介於 0 與 1 之間")
     return fvalue
 
+@functools.lru_cache(maxsize=256)
 def quality_type(value):
     try:
         ivalue = int(value)
@@ -58,6 +90,17 @@ def quality_type(value):
         raise argparse.ArgumentTypeError("品質必須介於 1 至 100 之間")
     return ivalue
 
+@functools.lru_cache(maxsize=256)
+def png_compress_level_type(value):
+    try:
+        ivalue = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{value} 不是一個整數")
+    if ivalue < 0 or ivalue > 9:
+        raise argparse.ArgumentTypeError("PNG 壓縮等級必須介於 0 至 9 之間")
+    return ivalue
+
+@functools.lru_cache(maxsize=256)
 def scale_type(value):
     try:
         fvalue = float(value)
@@ -67,6 +110,7 @@ def scale_type(value):
         raise argparse.ArgumentTypeError("縮放比例必須介於 1 至 100 之間")
     return fvalue
 
+@functools.lru_cache(maxsize=256)
 def uuid_length_type(value):
     try:
         ivalue = int(value)
@@ -76,12 +120,28 @@ def uuid_length_type(value):
         raise argparse.ArgumentTypeError("UUID 長度必須介於 4 至 36 之間")
     return ivalue
 
+@functools.lru_cache(maxsize=256)
 def large_image_threshold_type(value):
     ivalue = positive_int(value)
     if ivalue < 100 or ivalue > 10000:
         raise argparse.ArgumentTypeError("large_image_threshold 必須介於 100 至 10000 之間")
     return ivalue
 
+def position_type(value):
+    if value not in POSITION_FUNCS:
+        raise argparse.ArgumentTypeError(f"位置參數必須是 {', '.join(POSITION_FUNCS)} 其中之一")
+    return value
+
+def executor_type(value):
+    if value not in ("process", "thread"):
+        raise argparse.ArgumentTypeError("執行器必須是 process 或 thread")
+    return value
+
+def resample_type(value):
+    if value not in RESAMPLE_METHODS:
+        raise argparse.ArgumentTypeError(f"縮放演算法必須是 {', '.join(RESAMPLE_METHODS)} 其中之一")
+    return value
+
 def existing_file(value):
     if not os.path.isfile(value):
         raise argparse.ArgumentTypeError(f"{value} 不是一個存在的檔案")
@@ -96,168 +156,448 @@ def existing_folder(value):
 # -----------------------------
 # 全域記憶體監控參數與計數
 # -----------------------------
-MEMORY_CHECK_INTERVAL = 5  # 預設 5 秒
 gc_memory_threshold = 500  # 預設 500 MB
 gc_batch_size = 20         # 預設每 20 張圖片檢查一次
 
 image_counter = 0
 counter_lock = threading.Lock()
-stop_event = threading.Event()
+
+# 由 --quiet 設定；為 True 時不輸出逐檔的成功與預壓縮訊息，減少大量輸出造成的終端機 I/O 與鎖競爭
+_quiet = False
+
+# 平行處理管線中讀取與寫入檔案的線程數量（各自），可由 --io-threads 調整
+IO_THREADS = 4
+
+# 每個進程最多快取幾種尺寸的縮放後浮水印
+WATERMARK_CACHE_SIZE = 8
+
+# 支援的圖片副檔名（小寫）；JPEG 輸出另外處理
+_EXTS = frozenset({'.png', '.jpg', '.jpeg', '.bmp', '.gif'})
+_JPEG_EXTS = frozenset({'.jpg', '.jpeg'})
 
 # -----------------------------
 # 進階記憶體管理功能
 # -----------------------------
-def advanced_memory_management(file_path, base_img, enable_precompression, large_image_threshold):
-    if base_img.width > large_image_threshold or base_img.height > large_image_threshold:
-        if enable_precompression:
-            factor = min(large_image_threshold / base_img.width, large_image_threshold / base_img.height)
-            new_width = int(base_img.width * factor)
-            new_height = int(base_img.height * factor)
-            print(f"預壓縮：將圖片 {base_img.size} 縮小至 ({new_width}, {new_height})")
-            base_img = base_img.resize((new_width, new_height), Image.ANTIALIAS)
+def get_precompression_size(size, large_image_threshold):
+    width, height = size
+    if width > large_image_threshold or height > large_image_threshold:
+        factor = min(large_image_threshold / width, large_image_threshold / height)
+        return int(width * factor), int(height * factor)
+    return None
+
+def advanced_memory_management(base_img, enable_precompression, large_image_threshold, source_size=None):
+    # source_size 為 draft() 縮小解碼前的原始尺寸，預壓縮的目標尺寸與訊息皆以原始尺寸為準
+    source_size = source_size or base_img.size
+    if enable_precompression:
+        new_size = get_precompression_size(source_size, large_image_threshold)
+        if new_size is not None:
+            if not _quiet:
+                print(f"預壓縮：將圖片 {source_size} 縮小至 {new_size}")
+            base_img = resize_image(base_img, new_size)
     return base_img
 
-def check_and_collect_gc(threshold_bytes):
-    mem_used = psutil.Process(os.getpid()).memory_info().rss
+# psutil.Process 物件每個進程只建立一次；以 PID 比對，避免 fork 出的子進程沿用父進程的物件
+_process = None
+_gc_check_counter = 0
+
+def get_current_process():
+    # 子進程會重新載入本模組，psutil 延遲到實際需要時才匯入
+    import psutil  # 用於監控記憶體使用量
+    global _process
+    if _process is None or _process.pid != os.getpid():
+        _process = psutil.Process()
+    return _process
+
+_IS_LINUX = sys.platform.startswith("linux")
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if _IS_LINUX else None
+
+def get_rss():
+    # Linux 直接讀取 /proc/self/statm 的第二欄（常駐頁數），只需讀一小段文字，
+    # 不必像 psutil 解析 /proc/self/status；且取得的是目前用量而非 getrusage 的歷史峰值。其他平台退回 psutil
+    if _IS_LINUX:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    return get_current_process().memory_info().rss
+
+def check_and_collect_gc(threshold_bytes, batch_size):
+    # 每個進程每處理 batch_size 張圖片才檢查一次記憶體使用量，取代定時輪詢的監控線程；
+    # 多線程模式下計數偶有遺漏只會稍微延後檢查，不另外加鎖
+    global _gc_check_counter
+    _gc_check_counter += 1
+    if _gc_check_counter % batch_size:
+        return
+    mem_used = get_rss()
     if mem_used > threshold_bytes:
-        print(f"[子進程] 記憶體使用量 {mem_used/(1024*1024):.2f} MB 超過門檻，觸發 gc.collect()")
+        print(f"[記憶體檢查] 記憶體使用量 {mem_used/(1024*1024):.2f} MB 超過門檻，觸發 gc.collect()")
         gc.collect()
 
-# -----------------------------
-# 記憶體監控線程
-# -----------------------------
-def memory_monitor(monitor_interval, memory_threshold_bytes):
-    while not stop_event.is_set():
-        time.sleep(monitor_interval)
-        mem_used = psutil.Process(os.getpid()).memory_info().rss
-        if mem_used > memory_threshold_bytes:
-            print(f"[監控] 記憶體使用量達到 {mem_used/(1024*1024):.2f} MB，觸發垃圾回收...")
-            gc.collect()
-
 # -----------------------------
 # 圖片處理功能
 # -----------------------------
-def get_unique_path(output_path, uuid_length=6):
+# 已建立的輸出資料夾；同一資料夾只需呼叫一次 makedirs，不必每張圖片都發出一次 mkdir 系統呼叫
+_created_dirs = set()
+_created_dirs_lock = threading.Lock()
+
+def ensure_dir(path):
+    if path in _created_dirs:
+        return
+    with _created_dirs_lock:
+        if path not in _created_dirs:
+            os.makedirs(path, exist_ok=True)
+            _created_dirs.add(path)
+
+def get_unique_path(output_path, key, uuid_length=6):
     base, ext = os.path.splitext(output_path)
-    unique_suffix = uuid.uuid4().hex[:uuid_length]
+    # 後綴由輸入檔案的相對路徑以 blake2b 雜湊而來，不需讀取系統亂數；
+    # 同一輸入檔案每次執行都得到相同檔名，重複執行會覆寫先前的輸出而不會累積重複檔案
+    digest_size = (uuid_length + 1) // 2
+    unique_suffix = hashlib.blake2b(key.encode("utf-8", "surrogateescape"), digest_size=digest_size).hexdigest()[:uuid_length]
     return f"{base}_{unique_suffix}{ext}"
 
+_IDENTITY_LUT = bytes(range(256))
+
 def adjust_opacity(watermark, opacity):
     if watermark.mode != 'RGBA':
         watermark = watermark.convert('RGBA')
-    alpha = watermark.split()[3].point(lambda p: int(p * opacity))
-    watermark.putalpha(alpha)
-    return watermark
-
-def get_resample_method():
-    try:
-        return Image.Resampling.LANCZOS
-    except AttributeError:
-        return Image.ANTIALIAS
-
-def resize_watermark(watermark, base_image, scale):
-    base_width, base_height = base_image.size
-    base_dimension = min(base_width, base_height)
+    # 預先建立 256 項查表，point() 直接在 C 層查表，不需逐值呼叫 Python 函式；
+    # 查表內容以定點數計算 (p * k) >> 8，k 為透明度乘上 256，全程不需浮點運算
+    k = round(opacity * 256)
+    lut = bytes((p * k) >> 8 for p in range(256))
+    # RGBA 圖片可一次傳入 4 × 256 項查表，RGB 通道使用恆等表，只需一次配置與一次掃描，
+    # 不必 split() 拆出四個通道再以 putalpha() 寫回
+    return watermark.point(_IDENTITY_LUT * 3 + lut)
+
+# 模組層級共用一個縮放器，CPU 指令集由 cykooz.resizer 自動偵測
+if Resizer is not None:
+    _resizer = Resizer()
+    _resize_options = ResizeOptions(resize_alg=ResizeAlg.convolution(FilterType.lanczos3))
+else:
+    _resizer = None
+
+def set_resample(method):
+    # 每個進程於啟動時設定一次，浮水印與預壓縮的縮放皆使用同一演算法
+    global _RESAMPLE, _resize_options
+    _RESAMPLE, filter_name = RESAMPLE_METHODS[method]
+    if _resizer is not None:
+        resize_alg = ResizeAlg.nearest() if filter_name is None else ResizeAlg.convolution(getattr(FilterType, filter_name))
+        _resize_options = ResizeOptions(resize_alg=resize_alg)
+
+def resize_image(image, size):
+    if _resizer is not None and image.mode in ("RGB", "RGBA"):
+        resized = Image.new(image.mode, size)
+        _resizer.resize_pil(image, resized, _resize_options)
+        return resized
+    return image.resize(size, _RESAMPLE)
+
+def resize_watermark(watermark, base_size, scale):
+    base_dimension = min(base_size)
     target_width = int(base_dimension * scale / 100)
     orig_w, orig_h = watermark.size
     ratio = target_width / orig_w
-    resample_method = get_resample_method()
-    resized = watermark.resize((target_width, int(orig_h * ratio)), resample_method)
+    resized = resize_image(watermark, (target_width, int(orig_h * ratio)))
     return resized, ratio
 
-def get_position(pos_option, base_size, watermark_size, extra_bottom_scaled=0, margin=15):
-    base_width, base_height = base_size
-    watermark_width, watermark_height = watermark_size
-    allowed_positions = ["left_top", "top", "right_top", "bottom", "right_bottom"]
-    if pos_option not in allowed_positions:
-        raise argparse.ArgumentTypeError(f"位置參數必須是 {', '.join(allowed_positions)} 其中之一")
-    if pos_option == 'left_top':
-        x, y = margin, margin
-    elif pos_option == 'top':
-        x = (base_width - watermark_width) // 2
-        y = margin
-    elif pos_option == 'right_top':
-        x = base_width - watermark_width - margin
-        y = margin
-    elif pos_option == 'bottom':
-        x = (base_width - watermark_width) // 2
-        y = base_height - margin - (watermark_height - extra_bottom_scaled)
-    elif pos_option == 'right_bottom':
-        x = base_width - watermark_width - margin
-        y = base_height - margin - (watermark_height - extra_bottom_scaled)
-    return (int(x), int(y))
+# 各位置的座標公式，於啟動時依 --position 選定一次，處理每張圖片時不必再逐一比對字串
+def _position_left_top(base_width, base_height, watermark_width, watermark_height, extra_bottom_scaled, margin):
+    return margin, margin
+
+def _position_top(base_width, base_height, watermark_width, watermark_height, extra_bottom_scaled, margin):
+    return (base_width - watermark_width) // 2, margin
+
+def _position_right_top(base_width, base_height, watermark_width, watermark_height, extra_bottom_scaled, margin):
+    return base_width - watermark_width - margin, margin
+
+def _position_bottom(base_width, base_height, watermark_width, watermark_height, extra_bottom_scaled, margin):
+    return (base_width - watermark_width) // 2, int(base_height - margin - (watermark_height - extra_bottom_scaled))
+
+def _position_right_bottom(base_width, base_height, watermark_width, watermark_height, extra_bottom_scaled, margin):
+    return base_width - watermark_width - margin, int(base_height - margin - (watermark_height - extra_bottom_scaled))
+
+POSITION_FUNCS = {
+    "left_top": _position_left_top,
+    "top": _position_top,
+    "right_top": _position_right_top,
+    "bottom": _position_bottom,
+    "right_bottom": _position_right_bottom,
+}
 
 class WatermarkProcessor:
     def __init__(self, watermark_path, opacity):
         self.watermark = Image.open(watermark_path).convert("RGBA")
         self.watermark = adjust_opacity(self.watermark, opacity)
-    
-    def get_scaled_watermark(self, base_image, scale):
-        resized, ratio = resize_watermark(self.watermark, base_image, scale)
+        # 浮水印底部透明區域高度只需計算一次
         bbox = self.watermark.getbbox()
-        extra_bottom = self.watermark.height - bbox[3] if bbox else 0
-        extra_bottom_scaled = extra_bottom * ratio
-        return resized, extra_bottom_scaled
+        self._bbox_extra = self.watermark.height - bbox[3] if bbox else 0
+        # 縮放結果只取決於圖片較短邊與縮放比例，依此快取；
+        # 以 LRU 方式只保留最近使用的 WATERMARK_CACHE_SIZE 種尺寸，尺寸繁多的批次也不會讓記憶體持續成長
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+    
+    def get_scaled_watermark(self, base_size, scale):
+        # 只需要底圖尺寸，傳入 Image.open 由檔頭讀得的 size 即可，不必先解碼像素
+        key = (min(base_size), scale)
+        with self._cache_lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                return cached
+            resized, ratio = resize_watermark(self.watermark, base_size, scale)
+            cached = (resized, self._bbox_extra * ratio)
+            self._cache[key] = cached
+            if len(self._cache) > WATERMARK_CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return cached
+
+# 每個進程各自持有一個浮水印處理器，由 init_worker 建立；
+# 多進程模式下作為 ProcessPoolExecutor 的 initializer，浮水印只在子進程啟動時載入一次，
+# 不必隨每個任務序列化傳送，縮放快取也能跨任務重複使用
+_watermark_processor = None
+
+def init_worker(watermark_path, opacity, resample="lanczos", quiet=False):
+    global _watermark_processor, _quiet
+    _quiet = quiet
+    set_resample(resample)
+    _watermark_processor = WatermarkProcessor(watermark_path, opacity)
+
+def watermark_image(base_img, watermark_processor, position_fn, scale, margin_vertical, margin_horizontal, ext,
+                    enable_adv_mem, enable_precompression, large_image_threshold):
+    # JPEG 輸出的底圖維持 RGB，不必整張轉為 RGBA 後再轉回 RGB
+    is_jpeg = ext in _JPEG_EXTS
+    source_size = base_img.size
+    if is_jpeg and enable_adv_mem and enable_precompression:
+        # 大型 JPEG 即將被預壓縮時，讓 libjpeg 直接以 1/2、1/4 或 1/8 解析度解碼，
+        # 解碼結果不會小於預壓縮的目標尺寸，其餘部分再由 Lanczos 縮放完成
+        draft_size = get_precompression_size(base_img.size, large_image_threshold)
+        if draft_size is not None:
+            base_img.draft('RGB', draft_size)
+    target_mode = 'RGB' if is_jpeg else 'RGBA'
+    # RGB 或 RGBA 底圖先預壓縮再轉換模式，讓轉換只作用於縮小後的圖片，RGB 底圖的 Lanczos 也只需處理三個通道；
+    # 調色盤等其他模式無法直接以 Lanczos 縮放，仍須先轉換
+    if base_img.mode != target_mode and base_img.mode not in ('RGB', 'RGBA'):
+        base_img = base_img.convert(target_mode)
+    if enable_adv_mem:
+        base_img = advanced_memory_management(base_img, enable_precompression, large_image_threshold, source_size)
+    if base_img.mode != target_mode:
+        base_img = base_img.convert(target_mode)
+    margin_used = margin_vertical if base_img.width < base_img.height else margin_horizontal
+    scaled_wm, extra_bottom_scaled = watermark_processor.get_scaled_watermark(base_img.size, scale)
+    pos = position_fn(base_img.width, base_img.height, scaled_wm.width, scaled_wm.height, extra_bottom_scaled, margin_used)
+    # base_img 處理完即丟棄，直接在其上合成浮水印，不另外複製整張圖片
+    if is_jpeg:
+        # RGB 底圖沒有 alpha 通道，以浮水印自身的 alpha 作為遮罩直接貼上即等同 alpha 合成，不需任何中間圖片
+        base_img.paste(scaled_wm, pos, scaled_wm)
+        return base_img
+    # RGBA 底圖以遮罩貼上會連 alpha 通道一起混合，因此只對浮水印所在區域進行 alpha 合成後貼回
+    x, y = pos
+    wm_box = (x, y, x + scaled_wm.width, y + scaled_wm.height)
+    region = base_img.crop(wm_box)
+    region.alpha_composite(scaled_wm)
+    base_img.paste(region, wm_box)
+    region.close()
+    return base_img
 
-def process_image(file_path, output_path, watermark_processor, position, scale, quality, margin_vertical, margin_horizontal,
-                  enable_parallel, uuid_length, enable_adv_mem, enable_precompression, large_image_threshold, use_process_pool, mem_threshold_bytes):
+def save_image(result, target, ext, quality, png_compress_level):
+    image_format = Image.registered_extensions()[ext]
+    if ext in _JPEG_EXTS and quality is not None:
+        # 明確關閉 Huffman 最佳化與漸進式編碼，並使用 4:2:0 色度抽樣，固定走最快的編碼路徑
+        result.save(target, format=image_format, quality=quality, optimize=False, progressive=False, subsampling=2)
+    elif image_format == 'PNG':
+        # zlib 壓縮等級越低編碼越快，檔案則略大；Pillow 預設為 6
+        result.save(target, format=image_format, compress_level=png_compress_level)
+    else:
+        result.save(target, format=image_format)
+
+# 順序處理模式專用：平行處理改走 run_pipeline，因此不需加上檔名後綴
+def process_image(file_path, output_path, position_fn, scale, quality, png_compress_level, margin_vertical, margin_horizontal,
+                  enable_adv_mem, enable_precompression, large_image_threshold, mem_threshold_bytes, gc_batch_size):
     try:
+        ext = os.path.splitext(file_path)[1].lower()
         with Image.open(file_path) as base_img:
-            if base_img.mode != 'RGBA':
-                base_img = base_img.convert('RGBA')
-            if enable_adv_mem:
-                base_img = advanced_memory_management(file_path, base_img, enable_precompression, large_image_threshold)
-            margin_used = margin_vertical if base_img.width < base_img.height else margin_horizontal
-            scaled_wm, extra_bottom_scaled = watermark_processor.get_scaled_watermark(base_img, scale)
-            pos = get_position(position, base_img.size, scaled_wm.size, extra_bottom_scaled, margin_used)
-            result = base_img.copy()
-            result.paste(scaled_wm, pos, scaled_wm.split()[3])
-            ext = os.path.splitext(file_path)[1].lower()
-            if ext in ['.jpg', '.jpeg']:
-                result = result.convert('RGB')
-            os.makedirs(os.path.dirname(output_path), exist_ok=True)
-            final_output_path = get_unique_path(output_path, uuid_length) if enable_parallel else output_path
-            if ext in ['.jpg', '.jpeg'] and quality is not None:
-                result.save(final_output_path, quality=quality)
-            else:
-                result.save(final_output_path)
-            print(f"處理成功：{file_path} -> {final_output_path}")
-            if use_process_pool:
-                check_and_collect_gc(mem_threshold_bytes)
+            result = watermark_image(base_img, _watermark_processor, position_fn, scale, margin_vertical, margin_horizontal, ext,
+                                     enable_adv_mem, enable_precompression, large_image_threshold)
+            try:
+                ensure_dir(os.path.dirname(output_path))
+                save_image(result, output_path, ext, quality, png_compress_level)
+                if not _quiet:
+                    print(f"處理成功：{file_path} -> {output_path}")
+            finally:
+                # 存檔後立即釋放像素記憶體，不必等待參照消失或 gc 回收
+                result.close()
+                base_img.close()
+        check_and_collect_gc(mem_threshold_bytes, gc_batch_size)
     except Exception as e:
         print(f"處理失敗 {file_path}：{e}")
         sys.exit(1)
 
-def iter_files(input_folder, recursive):
-    if recursive:
-        for root, _, files in os.walk(input_folder):
-            for file in files:
-                if file.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.gif')):
-                    yield os.path.join(root, file)
-    else:
-        for file in os.listdir(input_folder):
-            file_path = os.path.join(input_folder, file)
-            if os.path.isfile(file_path) and file.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.gif')):
-                yield file_path
-
-def process_single(file_path, input_folder, output_folder, watermark_processor, position, scale, quality,
-                   margin_vertical, margin_horizontal, enable_parallel, uuid_length, enable_adv_mem, enable_precompression,
-                   large_image_threshold, use_process_pool, mem_threshold_bytes):
-    if os.path.isdir(input_folder):
-        rel_path = os.path.relpath(os.path.dirname(file_path), input_folder)
-        name, ext = os.path.splitext(os.path.basename(file_path))
-        out_filename = f"{name}_mk{ext}"
-        out_path = os.path.join(output_folder, rel_path, out_filename)
-    else:
-        name, ext = os.path.splitext(os.path.basename(file_path))
-        out_filename = f"{name}_mk{ext}"
-        out_path = os.path.join(output_folder, out_filename)
-    process_image(file_path, out_path, watermark_processor, position, scale, quality, margin_vertical, margin_horizontal,
-                  enable_parallel, uuid_length, enable_adv_mem, enable_precompression, large_image_threshold, use_process_pool, mem_threshold_bytes)
+def render_image(file_path, data, position_fn, scale, quality, png_compress_level, margin_vertical, margin_horizontal,
+                 enable_adv_mem, enable_precompression, large_image_threshold, mem_threshold_bytes, gc_batch_size):
+    # 平行處理管線的運算階段：由記憶體中的檔案內容解碼、合成浮水印並編碼，檔案讀寫交由 I/O 線程
+    ext = os.path.splitext(file_path)[1].lower()
+    output = io.BytesIO()
+    try:
+        base_img = Image.open(io.BytesIO(data))
+    except UnidentifiedImageError:
+        # 由記憶體解碼時 Pillow 的錯誤訊息只有 BytesIO 物件，改為帶上檔案路徑
+        raise UnidentifiedImageError(f"cannot identify image file {file_path!r}") from None
+    with base_img:
+        result = watermark_image(base_img, _watermark_processor, position_fn, scale, margin_vertical, margin_horizontal, ext,
+                                 enable_adv_mem, enable_precompression, large_image_threshold)
+        try:
+            save_image(result, output, ext, quality, png_compress_level)
+        finally:
+            result.close()
+            base_img.close()
+    check_and_collect_gc(mem_threshold_bytes, gc_batch_size)
+    return output.getvalue()
+
+def iter_files(input_folder, recursive, exclude_folder=None):
+    # os.scandir 回傳的 DirEntry 已帶有檔案類型資訊，判斷檔案或資料夾時不需額外 stat()
+    # 檔案邊掃描邊處理，若輸出資料夾位於輸入資料夾內，需略過以免處理到剛寫入的輸出檔
+    excluded = os.path.realpath(exclude_folder) if exclude_folder else None
+    pending = [input_folder]
+    while pending:
+        path = pending.pop()
+        if excluded is not None and os.path.realpath(path) == excluded:
+            continue
+        # 與 os.walk 相同，無法讀取的資料夾略過並繼續處理其他資料夾
+        try:
+            entries = os.scandir(path)
+        except OSError as e:
+            print(f"無法讀取資料夾 {path}：{e}")
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive:
+                        pending.append(entry.path)
+                    continue
+                # 只取副檔名部分查集合；副檔名多半已是小寫，查不到時才另外配置小寫字串
+                name = entry.name
+                ext = name[name.rfind('.'):]
+                if (ext in _EXTS or ext.lower() in _EXTS) and entry.is_file():
+                    yield entry.path
+
+def is_within_folder(path, folder):
+    path = os.path.realpath(path)
+    folder = os.path.realpath(folder)
+    return path == folder or path.startswith(os.path.join(folder, ''))
+
+def get_output_path(file_path, input_folder, output_folder):
+    # iter_files 只產生帶有副檔名的檔案，一次 rpartition 即可拆出目錄、主檔名與副檔名；
+    # input_folder 已由 existing_folder 確保為資料夾，不必每個檔案再 stat 一次
+    dir_name, _, filename = file_path.rpartition(os.sep)
+    name, _, ext = filename.rpartition('.')
+    rel_path = os.path.relpath(dir_name, input_folder)
+    return os.path.join(output_folder, rel_path, f"{name}_mk.{ext}")
+
+def process_single(file_path, input_folder, output_folder, process_one):
+    out_path = get_output_path(file_path, input_folder, output_folder)
+    process_one(file_path, out_path)
     global image_counter
     with counter_lock:
         image_counter += 1
 
+# -----------------------------
+# 平行處理管線 (讀取 -> 運算 -> 寫入)
+# -----------------------------
+_SENTINEL = None  # 通知下游階段結束的毒丸 (poison pill)
+
+# 直接以檔案描述符讀寫，每個檔案只需 open/fstat/read/close，省去緩衝檔案物件額外的 lseek、ioctl 等系統呼叫
+_O_BINARY = getattr(os, "O_BINARY", 0)
+
+def read_file(file_path):
+    fd = os.open(file_path, os.O_RDONLY | _O_BINARY)
+    try:
+        size = os.fstat(fd).st_size
+        data = os.read(fd, size)
+        if len(data) < size:
+            chunks = [data]
+            while True:
+                chunk = os.read(fd, size)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+            data = b"".join(chunks)
+        return data
+    finally:
+        os.close(fd)
+
+def write_file(file_path, data):
+    fd = os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | _O_BINARY, 0o666)
+    try:
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+    finally:
+        os.close(fd)
+
+def reader_worker(files_iter, files_lock, read_queue):
+    # 無論掃描或讀取是否出錯，結束時都必須送出結束標記，否則主線程會一直等待
+    try:
+        while True:
+            try:
+                with files_lock:
+                    file_path = next(files_iter, None)
+            except Exception as e:
+                print(f"掃描檔案失敗：{e}")
+                continue
+            if file_path is None:
+                break
+            try:
+                read_queue.put((file_path, read_file(file_path)))
+            except OSError as e:
+                print(f"處理失敗 {file_path}：{e}")
+    finally:
+        read_queue.put(_SENTINEL)
+
+def writer_worker(write_queue, input_folder, uuid_length):
+    global image_counter
+    while True:
+        item = write_queue.get()
+        if item is _SENTINEL:
+            break
+        file_path, output_path, future = item
+        try:
+            data = future.result()
+            ensure_dir(os.path.dirname(output_path))
+            final_output_path = get_unique_path(output_path, os.path.relpath(file_path, input_folder), uuid_length)
+            write_file(final_output_path, data)
+        except Exception as e:
+            print(f"處理失敗 {file_path}：{e}")
+            continue
+        if not _quiet:
+            print(f"處理成功：{file_path} -> {final_output_path}")
+        with counter_lock:
+            image_counter += 1
+
+def run_pipeline(executor, workers, io_threads, files, input_folder, output_folder, uuid_length, render_one):
+    # 佇列長度有上限，讀取速度過快時讀取線程會等待，避免所有圖片同時駐留記憶體
+    read_queue = queue.Queue(maxsize=2 * workers)
+    write_queue = queue.Queue(maxsize=2 * workers)
+    files_iter = iter(files)
+    files_lock = threading.Lock()
+    readers = [threading.Thread(target=reader_worker, args=(files_iter, files_lock, read_queue), daemon=True)
+               for _ in range(io_threads)]
+    writers = [threading.Thread(target=writer_worker, args=(write_queue, input_folder, uuid_length), daemon=True)
+               for _ in range(io_threads)]
+    for thread in readers + writers:
+        thread.start()
+
+    finished_readers = 0
+    while finished_readers < len(readers):
+        item = read_queue.get()
+        if item is _SENTINEL:
+            finished_readers += 1
+            continue
+        file_path, data = item
+        future = executor.submit(render_one, file_path, data)
+        write_queue.put((file_path, get_output_path(file_path, input_folder, output_folder), future))
+
+    for _ in writers:
+        write_queue.put(_SENTINEL)
+    for thread in readers + writers:
+        thread.join()
+
 # -----------------------------
 # 配置文件與命令列參數整合
 # -----------------------------
@@ -274,6 +614,10 @@ def parse_args():
                         help="浮水印位置，預設為 bottom（下方，水平置中）")
     parser.add_argument("--quality", "-q", type=quality_type, default="100",
                         help="輸出圖片壓縮率（1-100），預設為 100")
+    parser.add_argument("--png-compress-level", type=png_compress_level_type, default="1",
+                        help="PNG 輸出的 zlib 壓縮等級（0-9），數值越低編碼越快、檔案越大，預設為 1")
+    parser.add_argument("--resample", type=str, default="lanczos", choices=list(RESAMPLE_METHODS),
+                        help="浮水印與預壓縮的縮放演算法：lanczos（畫質最佳，預設）、bicubic、bilinear 或 nearest（最快）")
     parser.add_argument("--scale", "-s", type=scale_type, default="15",
                         help="浮水印縮放比例（1-100），預設為 15")
     parser.add_argument("--margin-vertical", "-mv", type=non_negative_int, default="20",
@@ -289,24 +633,33 @@ def parse_args():
     parser.add_argument("--gc-memory-threshold", type=positive_int, default="500",
                         help="記憶體使用量超過此門檻值（MB）時觸發垃圾回收，預設為 500 MB")
     parser.add_argument("--memory-check-interval", type=positive_int, default="5",
-                        help="記憶體監控線程檢查間隔（秒），預設為 5 秒")
+                        help="（已停用）原記憶體監控線程的檢查間隔（秒），保留以相容既有設定；記憶體改為每 gc-batch-size 張圖片檢查一次")
     parser.add_argument("--enable-mixed-mode", action="store_true", default=False,
                         help="是否啟用混合模式（先檢查記憶體使用量，再依據圖片數量作備用檢查）")
     parser.add_argument("--enable-parallel", action="store_true", default=False,
-                        help="是否啟用平行處理功能（預設關閉）；啟用時會在檔案名稱中加入 UUID")
+                        help="是否啟用平行處理功能（預設關閉）；啟用時會在檔案名稱中加入由輸入路徑雜湊產生的後綴")
+    parser.add_argument("--executor", type=str, default="process", choices=["process", "thread"],
+                        help="平行處理使用的執行器：process（多進程，預設）或 thread（多線程）")
+    parser.add_argument("--workers", type=non_negative_int, default="0",
+                        help="平行處理的工作者數量，0 表示使用 CPU 核心數，預設為 0")
+    parser.add_argument("--io-threads", type=positive_int, default=str(IO_THREADS),
+                        help=f"平行處理時讀取與寫入檔案的線程數量（各自），可依儲存裝置調整，預設為 {IO_THREADS}")
     parser.add_argument("--uuid-length", type=uuid_length_type, default="6",
-                        help="平行處理時輸出檔名中 UUID 的長度（4-36），預設為 6")
+                        help="平行處理時輸出檔名中後綴的長度（4-36），預設為 6")
     parser.add_argument("--enable-advanced-memory-management", action="store_true", default=False,
                         help="是否啟用進階記憶體管理功能（在多線程模式下對超大圖片進行進階管理）")
     parser.add_argument("--enable-precompression", action="store_true", default=False,
                         help="進階記憶體管理模式下是否啟用預壓縮大型圖片（降低解析度），預設為關閉")
     parser.add_argument("--large-image-threshold", type=large_image_threshold_type, default="3000",
                         help="當圖片寬或高超過此像素值時啟用進階記憶體管理功能（預壓縮）的判斷，介於 100 至 10000 之間，預設為 3000")
+    parser.add_argument("--quiet", action="store_true", default=False,
+                        help="不輸出逐檔的處理成功訊息，只在結束時輸出處理總數（失敗訊息仍會輸出）")
     parser.add_argument("--config", "-c", type=str, default=None,
                         help="配置文件 (INI 格式)，若存在則自動讀取")
     return parser.parse_args()
 
 def merge_config(args):
+    import configparser
     config_filename = args.config if args.config else "config.ini"
     if os.path.exists(config_filename):
         config = configparser.ConfigParser()
@@ -314,30 +667,38 @@ def merge_config(args):
             config.read(config_filename, encoding="utf-8")
             defaults = config["DEFAULT"]
             arg_map = {
-                "input_folder": ("--input-folder", existing_folder, "original"),
-                "watermark": ("--watermark", existing_file, "Logo.png"),
-                "opacity": ("--opacity", opacity_type, "0.65"),
-                "position": ("--position", str, "bottom"),
-                "quality": ("--quality", quality_type, "100"),
-                "scale": ("--scale", scale_type, "15"),
-                "margin_vertical": ("--margin-vertical", non_negative_int, "20"),
-                "margin_horizontal": ("--margin-horizontal", non_negative_int, "15"),
-                "output_folder": ("--output-folder", str, "output"),
-                "recursive": ("--recursive", lambda x: x.lower() in ["true", "1", "yes"], "False"),
-                "gc_batch_size": ("--gc-batch-size", positive_int, "20"),
-                "gc_memory_threshold": ("--gc-memory-threshold", positive_int, "500"),
-                "memory_check_interval": ("--memory-check-interval", positive_int, "5"),
-                "enable_mixed_mode": ("--enable-mixed-mode", lambda x: x.lower() in ["true", "1", "yes"], "False"),
-                "enable_parallel": ("--enable-parallel", lambda x: x.lower() in ["true", "1", "yes"], "False"),
-                "uuid_length": ("--uuid-length", uuid_length_type, "6"),
-                "enable_advanced_memory_management": ("--enable-advanced-memory-management", lambda x: x.lower() in ["true", "1", "yes"], "False"),
-                "enable_precompression": ("--enable-precompression", lambda x: x.lower() in ["true", "1", "yes"], "False"),
-                "large_image_threshold": ("--large-image-threshold", large_image_threshold_type, "3000")
+                "input_folder": (("--input-folder", "-if"), existing_folder, "original"),
+                "watermark": (("--watermark", "-w"), existing_file, "Logo.png"),
+                "opacity": (("--opacity", "-o"), opacity_type, "0.65"),
+                "position": (("--position", "-p"), position_type, "bottom"),
+                "quality": (("--quality", "-q"), quality_type, "100"),
+                "png_compress_level": (("--png-compress-level",), png_compress_level_type, "1"),
+                "resample": (("--resample",), resample_type, "lanczos"),
+                "scale": (("--scale", "-s"), scale_type, "15"),
+                "margin_vertical": (("--margin-vertical", "-mv"), non_negative_int, "20"),
+                "margin_horizontal": (("--margin-horizontal", "-mh"), non_negative_int, "15"),
+                "output_folder": (("--output-folder", "-of"), str, "output"),
+                "recursive": (("--recursive", "-r"), lambda x: x.lower() in ["true", "1", "yes"], "False"),
+                "gc_batch_size": (("--gc-batch-size",), positive_int, "20"),
+                "gc_memory_threshold": (("--gc-memory-threshold",), positive_int, "500"),
+                "memory_check_interval": (("--memory-check-interval",), positive_int, "5"),
+                "enable_mixed_mode": (("--enable-mixed-mode",), lambda x: x.lower() in ["true", "1", "yes"], "False"),
+                "enable_parallel": (("--enable-parallel",), lambda x: x.lower() in ["true", "1", "yes"], "False"),
+                "executor": (("--executor",), executor_type, "process"),
+                "workers": (("--workers",), non_negative_int, "0"),
+                "io_threads": (("--io-threads",), positive_int, str(IO_THREADS)),
+                "uuid_length": (("--uuid-length",), uuid_length_type, "6"),
+                "enable_advanced_memory_management": (("--enable-advanced-memory-management",), lambda x: x.lower() in ["true", "1", "yes"], "False"),
+                "enable_precompression": (("--enable-precompression",), lambda x: x.lower() in ["true", "1", "yes"], "False"),
+                "large_image_threshold": (("--large-image-threshold",), large_image_threshold_type, "3000"),
+                "quiet": (("--quiet",), lambda x: x.lower() in ["true", "1", "yes"], "False")
             }
-            for key, (flag, typ, default_val) in arg_map.items():
-                if not any(flag in sys.argv for flag in [flag.split()[0]]):
+            # 命令列實際給定的旗標只收集一次（含 --flag=value 形式），之後以集合查詢判斷是否由命令列覆寫
+            provided = {arg.split("=", 1)[0] for arg in sys.argv[1:]}
+            for key, (flags, typ, default_val) in arg_map.items():
+                if provided.isdisjoint(flags):
                     raw_val = defaults.get(key, default_val)
-                    if key in ["recursive", "enable_mixed_mode", "enable_parallel", "enable_advanced_memory_management", "enable_precompression"]:
+                    if key in ["recursive", "enable_mixed_mode", "enable_parallel", "enable_advanced_memory_management", "enable_precompression", "quiet"]:
                         setattr(args, key, defaults.getboolean(key, False))
                     else:
                         setattr(args, key, typ(raw_val))
@@ -349,60 +710,64 @@ def merge_config(args):
     return args
 
 def main():
+    import concurrent.futures
     args = merge_config(parse_args())
     mem_threshold_bytes = args.gc_memory_threshold * 1024 * 1024
 
-    # 選擇平行處理執行器：若啟用平行處理且進階記憶體管理同時啟用，使用 ProcessPoolExecutor
-    use_process_pool = args.enable_parallel and args.enable_advanced_memory_management
+    # 選擇平行處理執行器：Pillow 的解碼、縮放與編碼大多持有 GIL，預設使用 ProcessPoolExecutor，
+    # 僅在明確指定 --executor thread 時使用 ThreadPoolExecutor
+    use_process_pool = args.enable_parallel and args.executor == "process"
+    if use_process_pool and not getattr(sys, "_is_gil_enabled", lambda: True)():
+        # 自由線程 (free-threaded) 的 CPython 已停用 GIL，多線程即可平行運算，省去子進程啟動與資料傳遞的成本
+        print("偵測到 GIL 已停用，平行處理改用多線程執行器")
+        use_process_pool = False
     if args.enable_parallel:
         Executor = concurrent.futures.ProcessPoolExecutor if use_process_pool else concurrent.futures.ThreadPoolExecutor
     else:
         Executor = None
 
-    watermark_processor = WatermarkProcessor(args.watermark, args.opacity)
-    files = list(iter_files(args.input_folder, args.recursive))
-
-    monitor_thread = threading.Thread(target=memory_monitor, args=(args.memory_check_interval, mem_threshold_bytes), daemon=True)
-    monitor_thread.start()
+    position_fn = POSITION_FUNCS[args.position]
+    # 主進程先載入一次浮水印（順序與多線程模式直接使用，並可及早發現浮水印檔案錯誤）
+    init_worker(args.watermark, args.opacity, args.resample, args.quiet)
+    if not args.quiet:
+        print(f"縮放後端：{RESIZE_BACKEND}")
+    if is_within_folder(args.input_folder, args.output_folder):
+        # 輸出資料夾即為輸入資料夾或包含輸入資料夾時，輸出檔會寫入尚未掃描的資料夾，需先列出完整檔案清單
+        files = list(iter_files(args.input_folder, args.recursive))
+    else:
+        # 不預先建立完整檔案清單，掃描到的檔案直接交給處理流程
+        files = iter_files(args.input_folder, args.recursive, args.output_folder)
 
+    # 整個執行期間不變的參數在啟動時一次綁定，每張圖片只需傳入路徑（或檔案內容）
     if args.enable_parallel:
-        with Executor() as executor:
-            futures = [
-                executor.submit(
-                    process_single,
-                    file_path,
-                    args.input_folder,
-                    args.output_folder,
-                    watermark_processor,
-                    args.position,
-                    args.scale,
-                    args.quality,
-                    args.margin_vertical,
-                    args.margin_horizontal,
-                    args.enable_parallel,
-                    args.uuid_length,
-                    args.enable_advanced_memory_management,
-                    args.enable_precompression,
-                    args.large_image_threshold,
-                    use_process_pool,
-                    mem_threshold_bytes
-                )
-                for file_path in files
-            ]
-            concurrent.futures.wait(futures)
+        workers = args.workers or os.cpu_count() or 1
+        render_one = functools.partial(
+            render_image, position_fn=position_fn, scale=args.scale, quality=args.quality,
+            png_compress_level=args.png_compress_level,
+            margin_vertical=args.margin_vertical, margin_horizontal=args.margin_horizontal,
+            enable_adv_mem=args.enable_advanced_memory_management, enable_precompression=args.enable_precompression,
+            large_image_threshold=args.large_image_threshold,
+            mem_threshold_bytes=mem_threshold_bytes, gc_batch_size=args.gc_batch_size)
+        executor_kwargs = {"initializer": init_worker, "initargs": (args.watermark, args.opacity, args.resample, args.quiet)} if use_process_pool else {}
+        with Executor(max_workers=workers, **executor_kwargs) as executor:
+            run_pipeline(executor, workers, args.io_threads, files, args.input_folder, args.output_folder, args.uuid_length, render_one)
     else:
+        process_one = functools.partial(
+            process_image, position_fn=position_fn, scale=args.scale, quality=args.quality,
+            png_compress_level=args.png_compress_level,
+            margin_vertical=args.margin_vertical, margin_horizontal=args.margin_horizontal,
+            enable_adv_mem=args.enable_advanced_memory_management, enable_precompression=args.enable_precompression,
+            large_image_threshold=args.large_image_threshold,
+            mem_threshold_bytes=mem_threshold_bytes, gc_batch_size=args.gc_batch_size)
         for file_path in files:
-            process_single(file_path, args.input_folder, args.output_folder, watermark_processor,
-                           args.position, args.scale, args.quality, args.margin_vertical, args.margin_horizontal,
-                           args.enable_parallel, args.uuid_length,
-                           args.enable_advanced_memory_management, args.enable_precompression, args.large_image_threshold,
-                           False, mem_threshold_bytes)
+            process_single(file_path, args.input_folder, args.output_folder, process_one)
     
+    if args.quiet:
+        print(f"處理完成，共成功處理 {image_counter} 張圖片")
+
     # 程式結束前，釋放資源並呼叫 gc.collect()
-    del files, watermark_processor
+    del files
     gc.collect()
-    stop_event.set()
-    monitor_thread.join()
     sys.exit(0)
 
 if __name__ == "__main__":